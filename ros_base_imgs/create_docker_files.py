@@ -1,17 +1,20 @@
 #!/usr/bin/env python3
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timezone
 import getpass
 import os
 from pathlib import Path
-import re
 import shutil
-import subprocess
+import stat
+import string
 import sys
 import tempfile
+from typing import Callable, IO, Literal
 
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 
 if __name__ == "__main__":
 
@@ -21,6 +24,103 @@ if __name__ == "__main__":
         "jazzy": "2:24.04",
     }
 
+    # Sorted by ROS version, then Ubuntu version, then distro name for consistent help output.
+    # ROS_DISTROS is constant, so the sorting and the help text are computed only once.
+    _ROS_DISTROS_SORTED: tuple[tuple[str, str], ...] = tuple(
+        sorted(ROS_DISTROS.items(), key=lambda item: (int(item[1].split(":")[0]), item[1].split(":")[1], item[0]))
+    )
+
+    _ROS_DISTROS_HELP = "\n".join(
+        [
+            "Available ROS distros:",
+            *(
+                f"    {key:<6}: ros{value.split(':')[0]}, ubuntu {value.split(':')[1]}."
+                for key, value in _ROS_DISTROS_SORTED
+            ),
+        ]
+    )
+
+    _ROS_DISTROS_NAMES = frozenset(ROS_DISTROS)
+
+    # Characters allowed in the parts of a Docker image name [HOST[:PORT_NUMBER]/]PATH[:TAG]:
+    #   • HOST: lower‑case letters, digits, dots and dashes.
+    #   • PORT_NUMBER: digits.
+    #   • PATH: components of lower‑case letters and digits, separated by separators.
+    #   • TAG: letters, digits, underscores, dots and dashes.
+    _DIGITS = frozenset(string.digits)
+    _LOWER_ALNUMS = frozenset(string.ascii_lowercase + string.digits)
+    _HOST_CHARS = _LOWER_ALNUMS | frozenset(".-")
+    _TAG_CHARS = frozenset(string.ascii_letters + string.digits + "_.-")
+
+    # Maximum amount of data copied at once when a file is copied to the context directory.
+    _COPY_CHUNK_SIZE = 1 << 20
+
+    @dataclass(frozen=True, slots=True)
+    class Item:
+        """
+        Element to install in the context directory.
+
+        kind: 'dir' (directory), 'file' (file copied as is) or 'template' (file rendered with Jinja2).
+        src: Source name, relative to root_path. If None, the element is created empty instead of being
+            copied from a resource (not allowed for templates).
+        context: Context for the Jinja2 rendering of templates.
+        executable: Whether the installed file is executable.
+        """
+
+        kind: Literal["dir", "file", "template"]
+        src: str | None
+        context: dict[str, str | bool] | None = None
+        executable: bool = False
+
+    def copy_file(src_path: Path, dst_path: Path, mode: int) -> None:
+        # The data is copied by the kernel, so it doesn't go through user space:
+        #   • copy_file_range: file systems with reflink support (e.g. Btrfs, XFS) share the data blocks
+        #     instead of duplicating them.
+        #   • sendfile: used if copy_file_range is not supported between the file systems (e.g. EXDEV
+        #     in old kernels), it copies the data between the page caches of both files.
+        # Hard links are not used, since the permissions set on the copy would also be applied to the
+        # source file, which is under source control.
+        with src_path.open("rb") as fsrc, open_for_writing(dst_path, mode, binary=True) as fdst:
+            src_fd = fsrc.fileno()
+            dst_fd = fdst.fileno()
+            size = os.fstat(src_fd).st_size
+
+            kernel_copies: list[Callable[[int], int]] = [
+                lambda count: os.copy_file_range(src_fd, dst_fd, count),
+                lambda count: os.sendfile(dst_fd, src_fd, None, count),
+            ]
+
+            for kernel_copy in kernel_copies:
+                remaining = size
+
+                try:
+                    while remaining > 0:
+                        copied = kernel_copy(min(remaining, _COPY_CHUNK_SIZE))
+
+                        if copied == 0:
+                            break
+
+                        remaining -= copied
+                except (AttributeError, OSError):
+                    # Not available in this platform or not supported for these files, start again
+                    # with the next method.
+                    fsrc.seek(0)
+                    fdst.seek(0)
+                    fdst.truncate()
+                    continue
+
+                if remaining == 0:
+                    return
+
+                # Some file systems (e.g. FUSE, NFS or some overlay setups) report that nothing was copied
+                # instead of failing. If that happens before copying anything, the method is not supported
+                # for these files and the next one is used. If it happens partway, the copy would be
+                # truncated, so it is an error.
+                if remaining < size:
+                    raise OSError(f"Copy of '{src_path}' to '{dst_path}' stopped before the end of the file")
+
+            shutil.copyfileobj(fsrc, fdst, _COPY_CHUNK_SIZE)
+
     def create_items_to_install(
         base_img: str,
         img_user: str,
@@ -32,225 +132,256 @@ if __name__ == "__main__":
         use_host_nvidia_driver: bool,
         ros_packages_file: Path,
         extra_ros_env_vars_file: Path,
-    ) -> dict[str, list[str | dict[str, str] | bool]]:
-
-        if not ros_packages_file.is_file():
+    ) -> list[tuple[str, Item]]:
+
+        # The files are read as bytes, so they are checked without decoding them, and only decoded once
+        # to be passed to the Jinja2 context. A missing file is detected by the read itself, without
+        # checking it beforehand.
+        try:
+            ros_packages_bytes = ros_packages_file.read_bytes()
+        except (FileNotFoundError, IsADirectoryError):
             print(f"File '{str(ros_packages_file)}' not found.")
             sys.exit(1)
 
-        with ros_packages_file.open("r") as f:
-            ros_packages = f.read()
-
-        if not ros_packages.strip():
+        if not ros_packages_bytes.strip():
             print(f"File '{str(ros_packages_file)}' is empty.")
             sys.exit(1)
 
-        if not extra_ros_env_vars_file.is_file():
+        try:
+            extra_ros_env_vars_bytes = extra_ros_env_vars_file.read_bytes()
+        except (FileNotFoundError, IsADirectoryError):
             print(f"File '{str(extra_ros_env_vars_file)}' not found.")
             sys.exit(1)
 
-        with extra_ros_env_vars_file.open("r") as f:
-            extra_ros_env_vars = f.read()
-
-        if not extra_ros_env_vars.strip():
+        if not extra_ros_env_vars_bytes.strip():
             print(f"File '{str(extra_ros_env_vars_file)}' is empty.")
             sys.exit(1)
 
-        # Items to use.
-        # Source is relative to base_dir, destination relative to context_path)
-        # (src_name, dst_name, is_executable)
-        items_to_install = {
-            "Dockerfile": [
-                "Dockerfile.j2",
-                {
-                    "base_img": base_img,
-                    "img_user": img_user,
-                    "img_user_home": f"/home/{img_user}",
-                    "ros_distro": ros_distro,
-                    "ros_version": ros_version,
-                    "use_base_img_entrypoint": use_base_img_entrypoint,
-                    "use_environment": use_environment,
-                    "extra_ros_env_vars": extra_ros_env_vars,
-                },
-                False,
-            ],
-            "build.py": [
-                "build.j2",
-                {
-                    "base_img": base_img,
-                    "img_id": img_id_to_build,
-                    "img_user": img_user,
-                    "ros_distro": ros_distro,
-                    "ros_version": ros_version,
-                },
-                True,
-            ],
-            "deduplicate_path.sh": ["deduplicate_path.sh", True],
-            "docker-compose.yaml": [
-                "docker-compose.j2",
-                {
-                    "service": f"{img_id_to_build.replace(':', '_').replace('/', '_')}_cont",
-                    "img_id": img_id_to_build,
-                    "img_workspace_dir": f"/home/{img_user}/workspace",
-                    "img_datasets_dir": f"/home/{img_user}/datasets",
-                    "img_ssh_dir": f"/home/{img_user}/.ssh",
-                    "img_gitconfig_file": f"/home/{img_user}/.gitconfig",
-                    "use_host_nvidia_driver": use_host_nvidia_driver,
-                    "ext_uid": f"{os.getuid()}",
-                    "ext_upgid": f"{os.getgid()}",
-                },
-                False,
-            ],
-            "dot_bash_aliases": ["dot_bash_aliases", True],
-            "install_base_system.sh": ["install_base_system.sh", True],
-            "install_ros.sh": [
-                "install_ros.j2",
-                {"use_environment": use_environment, "ros_packages": ros_packages},
-                True,
-            ],
-            "rosbuild.sh": [f"ros{ros_version}build.sh", True],
-            "rosdep_init_update.sh": ["rosdep_init_update.sh", True],
-        }
+        ros_packages = ros_packages_bytes.decode("utf-8")
+        extra_ros_env_vars = extra_ros_env_vars_bytes.decode("utf-8")
+
+        # Items to use. They are installed concurrently, so the order of the list only sets the order in
+        # which they are validated (and reported) and the order of the entries of the .dockerignore file.
+        # Source is relative to root_path, destination relative to context_path.
+        # (dst_name, Item)
+        items_to_install = [
+            (
+                "Dockerfile",
+                Item(
+                    "template",
+                    "Dockerfile.j2",
+                    {
+                        "base_img": base_img,
+                        "img_user": img_user,
+                        "img_user_home": f"/home/{img_user}",
+                        "ros_distro": ros_distro,
+                        "ros_version": ros_version,
+                        "use_base_img_entrypoint": use_base_img_entrypoint,
+                        "use_environment": use_environment,
+                        "extra_ros_env_vars": extra_ros_env_vars,
+                    },
+                ),
+            ),
+            (
+                "build.py",
+                Item(
+                    "template",
+                    "build.j2",
+                    {
+                        "base_img": base_img,
+                        "img_id": img_id_to_build,
+                        "img_user": img_user,
+                        "ros_distro": ros_distro,
+                        "ros_version": ros_version,
+                    },
+                    executable=True,
+                ),
+            ),
+            ("deduplicate_path.sh", Item("file", "deduplicate_path.sh", executable=True)),
+            (
+                "docker-compose.yaml",
+                Item(
+                    "template",
+                    "docker-compose.j2",
+                    {
+                        "service": f"{img_id_to_build.replace(':', '_').replace('/', '_')}_cont",
+                        "img_id": img_id_to_build,
+                        "img_workspace_dir": f"/home/{img_user}/workspace",
+                        "img_datasets_dir": f"/home/{img_user}/datasets",
+                        "img_ssh_dir": f"/home/{img_user}/.ssh",
+                        "img_gitconfig_file": f"/home/{img_user}/.gitconfig",
+                        "use_host_nvidia_driver": use_host_nvidia_driver,
+                        "ext_uid": f"{os.getuid()}",
+                        "ext_upgid": f"{os.getgid()}",
+                    },
+                ),
+            ),
+            ("dot_bash_aliases", Item("file", "dot_bash_aliases", executable=True)),
+            ("install_base_system.sh", Item("file", "install_base_system.sh", executable=True)),
+            (
+                "install_ros.sh",
+                Item(
+                    "template",
+                    "install_ros.j2",
+                    {"use_environment": use_environment, "ros_packages": ros_packages},
+                    executable=True,
+                ),
+            ),
+            ("rosbuild.sh", Item("file", f"ros{ros_version}build.sh", executable=True)),
+            ("rosdep_init_update.sh", Item("file", "rosdep_init_update.sh", executable=True)),
+        ]
 
         if ros_version == "2":
-            items_to_install["colcon_mixin_metadata.sh"] = [
-                "colcon_mixin_metadata.sh",
-                True,
-            ]
-            items_to_install["rosdep_ignored_keys.yaml"] = [
-                "rosdep_ignored_keys_ros2.yaml",
-                False,
-            ]
+            items_to_install.extend(
+                [
+                    ("colcon_mixin_metadata.sh", Item("file", "colcon_mixin_metadata.sh", executable=True)),
+                    ("rosdep_ignored_keys.yaml", Item("file", "rosdep_ignored_keys_ros2.yaml")),
+                ]
+            )
 
         if not args.use_base_img_entrypoint:
-            items_to_install["entrypoint.sh"] = ["entrypoint.sh", True]
+            items_to_install.append(("entrypoint.sh", Item("file", "entrypoint.sh", executable=True)))
 
         if use_environment:
-            items_to_install["environment.sh"] = [f"environment_ros{ros_version}.j2", {"ros_distro": ros_distro}, True]
+            items_to_install.append(
+                (
+                    "environment.sh",
+                    Item("template", f"environment_ros{ros_version}.j2", {"ros_distro": ros_distro}, executable=True),
+                )
+            )
 
         if not args.use_host_nvidia_driver:
-            items_to_install["install_mesa_packages.sh"] = [
-                "install_default_mesa_packages.sh",
-                True,
-            ]
+            items_to_install.append(
+                ("install_mesa_packages.sh", Item("file", "install_default_mesa_packages.sh", executable=True))
+            )
 
         return items_to_install
 
-    def get_ros_distros_str_for_help() -> str:
-        lines = ["Available ROS distros:"]
-
-        # Sort by ROS version, then Ubuntu version, then distro name for consistent help output
-        sorted_distros = sorted(
-            ROS_DISTROS.items(), key=lambda item: (int(item[1].split(":")[0]), item[1].split(":")[1], item[0])
-        )
-
-        for key, value in sorted_distros:
-            ros_version, ubuntu_version = value.split(":")
-            lines.append(f"    {key:<6}: ros{ros_version}, ubuntu {ubuntu_version}.")
+    def install_items(items_to_install: list[tuple[str, Item]], context_dir: Path) -> None:
+        def materialize_dir(item: Item, src_path: Path | None, dst_path: Path) -> None:
+            if src_path is not None:
+                dst_path.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copytree(
+                    src_path,
+                    dst_path,
+                    copy_function=lambda src, dst: copy_file(Path(src), Path(dst), stat.S_IMODE(os.stat(src).st_mode)),
+                )
+                dst_path.chmod(0o775)
+            else:
+                dst_path.mkdir(parents=True)
+
+        def materialize_file(item: Item, src_path: Path | None, dst_path: Path) -> None:
+            dst_path.parent.mkdir(parents=True, exist_ok=True)
+
+            if src_path is not None:
+                copy_file(src_path, dst_path, 0o775 if item.executable else 0o664)
+            else:
+                open_for_writing(dst_path, 0o775 if item.executable else 0o664).close()
+
+        def materialize_template(item: Item, src_path: Path | None, dst_path: Path) -> None:
+            dst_path.parent.mkdir(parents=True, exist_ok=True)
+            jinja2_template = _JINJA_ENV.get_template(item.src)
+
+            # The rendered chunks are written directly to the file, without building the whole
+            # rendered text in memory first.
+            with open_for_writing(dst_path, 0o775 if item.executable else 0o664) as f:
+                jinja2_template.stream(item.context).dump(f)
+
+        # Directory: an empty one is created if src_path is None, otherwise it's copied recursively.
+        def validate_dir(item: Item, src_path: Path | None, src_mode: int, dst_path: Path) -> None:
+            print(f"Creating directory '{dst_path}'")
+
+            if src_path is not None and not stat.S_ISDIR(src_mode):
+                print(f"Required resource '{str(src_path)}' is not a directory.")
+                sys.exit(1)
+
+        # File with permissions: an empty one is created if src_path is None, otherwise it's copied.
+        def validate_file(item: Item, src_path: Path | None, src_mode: int, dst_path: Path) -> None:
+            print(f"Creating file '{dst_path}'")
+
+            if src_path is not None and not stat.S_ISREG(src_mode):
+                print(f"Required resource '{str(src_path)}' is not a file.")
+                sys.exit(1)
+
+        # File rendered with Jinja2 and permissions: it requires a source and a context to render it.
+        def validate_template(item: Item, src_path: Path | None, src_mode: int, dst_path: Path) -> None:
+            print(f"Creating file '{dst_path}'")
+
+            if src_path is None:
+                print(f"Relative source path can't be empty for element '{str(dst_path)}'.")
+                sys.exit(1)
+
+            if not stat.S_ISREG(src_mode):
+                print(f"Required resource '{str(src_path)}' is not a file.")
+                sys.exit(1)
+
+            if item.context is None:
+                print(f"Context for Jinja2 rendering can't be None for element '{str(dst_path)}'.")
+                sys.exit(1)
+
+            if not isinstance(item.context, dict):
+                print(f"Context for Jinja2 rendering must be a dictionary for element '{str(dst_path)}'.")
+                sys.exit(1)
+
+        # (validate, materialize) functions for every kind of item. Items are validated in this thread,
+        # and materialized in the worker threads.
+        item_handlers: dict[
+            str,
+            tuple[Callable[[Item, Path | None, int, Path], None], Callable[[Item, Path | None, Path], None]],
+        ] = {
+            "dir": (validate_dir, materialize_dir),
+            "file": (validate_file, materialize_file),
+            "template": (validate_template, materialize_template),
+        }
 
-        return "\n".join(lines)
+        def materialize_item(item_to_materialize: tuple[Item, Path | None, Path]) -> None:
+            item, src_path, dst_path = item_to_materialize
+            _, materialize = item_handlers[item.kind]
+            materialize(item, src_path, dst_path)
 
-    def img_exists_locally(img: str) -> bool:
-        cmd = ["docker", "image", "inspect", img]
-        # capture=True -> stdout y stderr redireted to PIPE (they are not shown in the terminal)
-        # check=False  -> it does not throw exception if the image does not exist
-        result = run_command(cmd, capture=True, check=False)
-        return result.returncode == 0
+        # All the items are validated before any of them is installed.
+        items_to_materialize: list[tuple[Item, Path | None, Path]] = []
 
-    def install_items(items_to_install: dict[str, list[str | dict[str, str] | bool]], context_dir: Path) -> None:
-        # Copy the items to use to the context directory.
-        for key in sorted(items_to_install.keys()):
+        for key, item in items_to_install:
             dst_path = context_dir.joinpath(key)
 
-            item = items_to_install[key]
+            if item.kind not in item_handlers:
+                print(f"Unknown kind '{item.kind}' for element '{str(dst_path)}'.")
+                sys.exit(1)
 
-            # If the item[0] is None, it means that the key, that can be a file or a directory, must
+            # If item.src is None, it means that the key, that can be a file or a directory, must
             # be created, not copied from a resource.
             src_path = None
+            # The source is stat'ed only once, and its type is checked from the result.
+            src_mode = 0
 
-            if item[0] is not None:
-                src_path = root_path.joinpath(item[0])
+            if item.src is not None:
+                src_path = root_path.joinpath(item.src)
 
-                if not src_path.exists():
+                try:
+                    src_mode = os.stat(src_path).st_mode
+                except FileNotFoundError:
                     print(f"Required resource '{str(src_path)}' does not exist.")
                     sys.exit(1)
 
-            # len = 1 -> directory
-            #    src_path is None -> create an empty directory
-            #    src_path is not None -> copy the directory recursively
-            # len = 2 -> file with permissions
-            #    src_path is None -> create an empty file with permissions
-            #    src_path is not None -> copy the file with permissions
-            # len = 3 -> file with Jinja2 rendering and permissions
-            #    src_path is None -> raise an exception, not allowed
-            #    src_path is not None -> copy the file with Jinja2 rendering and permissions
-            if len(item) == 1:
-                print(f"Creating directory '{dst_path}'")
-
-                if src_path is not None:
-                    if not src_path.is_dir():
-                        print(f"Required resource '{str(src_path)}' is not a directory.")
-                        sys.exit(1)
-
-                    if not dst_path.parent.exists():
-                        dst_path.parent.mkdir(parents=True)
-
-                    shutil.copytree(src_path, dst_path, copy_function=shutil.copy2)
-                    dst_path.chmod(0o775)
-                else:
-                    dst_path.mkdir(parents=True)
-            elif len(item) == 2:
-                print(f"Creating file '{dst_path}'")
-
-                if src_path is not None:
-                    if not src_path.is_file():
-                        print(f"Required resource '{str(src_path)}' is not a file.")
-                        sys.exit(1)
-
-                    if not dst_path.parent.exists():
-                        dst_path.parent.mkdir(parents=True)
-
-                    shutil.copy2(src_path, dst_path)
-                else:
-                    dst_path.touch()
-
-                if item[1]:
-                    dst_path.chmod(0o775)
-                else:
-                    dst_path.chmod(0o664)
-            elif len(item) == 3:
-                print(f"Creating file '{dst_path}'")
-
-                if src_path is None:
-                    print(f"Relative source path can't be empty for element '{str(dst_path)}'.")
-                    sys.exit(1)
-
-                if not src_path.is_file():
-                    print(f"Required resource '{str(src_path)}' is not a file.")
-                    sys.exit(1)
-
-                context = item[1]
+            validate, _ = item_handlers[item.kind]
+            validate(item, src_path, src_mode, dst_path)
+            items_to_materialize.append((item, src_path, dst_path))
 
-                if context is None:
-                    print(f"Context for Jinja2 rendering can't be None for element '{str(dst_path)}'.")
+        # Copy the items to use to the context directory. Every item has its own destination, and
+        # installing it is mostly waiting for the file system, so the items are installed concurrently.
+        # Consuming the results re-raises in this thread any error raised while installing an item.
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(materialize_item, items_to_materialize))
 
-                if not isinstance(context, dict):
-                    print(f"Context for Jinja2 rendering must be a dictionary for element '{str(dst_path)}'.")
+        # Only the installed items are part of the build context sent to the Docker daemon, so any other
+        # file that ends up in the context directory is not scanned nor transferred.
+        dockerignore_path = context_dir.joinpath(".dockerignore")
+        print(f"Creating file '{dockerignore_path}'")
+        dockerignore_patterns = ["**", *(f"!{key}" for key, _ in items_to_install)]
 
-                if not dst_path.parent.exists():
-                    dst_path.parent.mkdir(parents=True)
-
-                jinja2_env = Environment(loader=FileSystemLoader(src_path.parent), trim_blocks=True, lstrip_blocks=True)
-                jinja2_template = jinja2_env.get_template(src_path.name)
-                rendered_text = jinja2_template.render(context)
-
-                with dst_path.open("w") as f:
-                    f.write(rendered_text)
-
-                if item[2]:
-                    dst_path.chmod(0o775)
-                else:
-                    dst_path.chmod(0o664)
+        with open_for_writing(dockerignore_path, 0o664) as f:
+            f.write("\n".join(dockerignore_patterns) + "\n")
 
     def is_valid_docker_img_name(name: str) -> bool:
         """
@@ -259,45 +390,109 @@ if __name__ == "__main__":
         Format:
             [HOST[:PORT_NUMBER]/]PATH[:TAG]
 
+        The name is validated with a single scan of every part, instead of with a backtracking regex.
+
         See: https://docs.docker.com/get-started/docker-concepts/building-images/build-tag-and-publish-an-image/#tagging-images
         """
 
-        # Optional registry prefix: host (lower‑case letters, digits, dots, dashes)
-        # with optional :PORT, followed by a slash.
-        host_and_port_prefix = r"([a-z0-9.-]+(:[0-9]+)?/)?"
+        # Optional TAG: the last colon starts the tag if there is no slash after it, since neither the
+        # PATH nor the tag can contain colons, and the PORT_NUMBER is always followed by a slash.
+        tag_start = name.rfind(":")
+
+        if tag_start > name.rfind("/"):
+            tag = name[tag_start + 1 :]
+
+            if not tag or any(c not in _TAG_CHARS for c in tag):
+                return False
 
-        # A separator inside a path component can be:
-        #   • a single dot
-        #   • one or two underscores
-        #   • one or more dashes
-        path_separator = r"(?:\.|_{1,2}|-+)"
+            name = name[:tag_start]
 
-        # A path component must start and end with an alphanumeric character,
-        # separators are allowed only between alphanumerics.
-        path_component = rf"[a-z0-9]+(?:{path_separator}[a-z0-9]+)*"
+        if is_valid_docker_img_path(name):
+            return True
 
-        # PATH = one or more components separated by '/'
-        path_re = rf"{path_component}(/{path_component})*"
+        # Optional registry prefix: HOST[:PORT_NUMBER], followed by a slash.
+        prefix_end = name.find("/")
 
-        # Optional TAG: colon + allowed characters (letters, digits, '_', '.', '-')
-        tag_re = r"(:[a-zA-Z0-9_.-]+)?"
+        if prefix_end == -1:
+            return False
 
-        # Full regex combining all parts
-        full_re = re.compile(rf"^{host_and_port_prefix}{path_re}{tag_re}$")
+        host, port_sep, port = name[:prefix_end].partition(":")
 
-        return bool(full_re.match(name))
+        if not host or any(c not in _HOST_CHARS for c in host):
+            return False
 
-    def run_command(
-        cmd: list[str], capture: bool = False, check: bool = True, cwd: Path | None = None
-    ) -> subprocess.CompletedProcess:
-        return subprocess.run(cmd, check=check, text=True, capture_output=capture, cwd=cwd)
+        if port_sep and (not port or any(c not in _DIGITS for c in port)):
+            return False
+
+        return is_valid_docker_img_path(name[prefix_end + 1 :])
+
+    def is_valid_docker_img_path(path: str) -> bool:
+        # PATH = one or more components separated by '/'.
+        for component in path.split("/"):
+            # A path component must start and end with an alphanumeric character,
+            # separators are allowed only between alphanumerics.
+            if not component or component[0] not in _LOWER_ALNUMS or component[-1] not in _LOWER_ALNUMS:
+                return False
+
+            i = 0
+
+            while i < len(component):
+                if component[i] in _LOWER_ALNUMS:
+                    i += 1
+                    continue
+
+                separator_start = i
+
+                while component[i] not in _LOWER_ALNUMS:
+                    i += 1
+
+                # A separator inside a path component can be:
+                #   • a single dot
+                #   • one or two underscores
+                #   • one or more dashes
+                separator = component[separator_start:i]
+
+                if separator not in (".", "_", "__") and separator.strip("-"):
+                    return False
+
+        return True
+
+    def open_for_writing(path: Path, mode: int, binary: bool = False) -> IO:
+        # The file is created with its final permissions, so they don't need to be set afterwards by
+        # path. The mode passed to os.open is masked by the process' umask, so it's also applied to the
+        # new file descriptor.
+        f = os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode), "wb" if binary else "w")
+
+        try:
+            os.fchmod(f.fileno(), mode)
+        except OSError:
+            f.close()
+            raise
+
+        return f
 
     # --------------------------------------------------------------------------------------------------
     # Main execution block
     # --------------------------------------------------------------------------------------------------
 
     script_name = Path(__file__).name
-    base_dir = Path(__file__).parent.resolve()
+    root_path = Path(__file__).resolve().parent
+
+    # A single Jinja2 environment is shared by all the templates, so compiled templates are cached
+    # (without size limit) instead of being re-parsed by a new environment for every element.
+    # The compiled bytecode is also persisted on disk, so later runs of this script don't need to
+    # compile the templates again (the cache is invalidated if a template changes). Jinja2 keeps the
+    # cache in its own per-user directory, only accessible by its owner, so cache files created by
+    # other users are never loaded.
+
+    _JINJA_ENV = Environment(
+        loader=FileSystemLoader(str(root_path)),
+        trim_blocks=True,
+        lstrip_blocks=True,
+        auto_reload=False,
+        cache_size=-1,
+        bytecode_cache=FileSystemBytecodeCache(),
+    )
 
     parser = argparse.ArgumentParser(
         description="Builds a Docker image with and active user and ROS",
@@ -316,7 +511,7 @@ if __name__ == "__main__":
 
     parser.add_argument("img_user", type=str, help="User to run containers for the resulting Docker image")
 
-    parser.add_argument("ros_distro", type=str, help=f"ROS distro.\n{get_ros_distros_str_for_help()}")
+    parser.add_argument("ros_distro", type=str, help=f"ROS distro.\n{_ROS_DISTROS_HELP}")
 
     parser.add_argument("img_id", type=str, help="Image ID for the resulting Docker image.")
 
@@ -357,8 +552,8 @@ if __name__ == "__main__":
     img_id_to_build = args.img_id.strip()  # Required, so won't be empty
     use_environment = not args.no_environment
 
-    if ros_distro not in ROS_DISTROS:
-        print(f"Error: Invalid ROS distro '{ros_distro}'. Allowed: {get_ros_distros_str_for_help()}")
+    if ros_distro not in _ROS_DISTROS_NAMES:
+        print(f"Error: Invalid ROS distro '{ros_distro}'. Allowed: {_ROS_DISTROS_HELP}")
         sys.exit(1)
 
     ros_version, ubuntu_version = ROS_DISTROS[ros_distro].split(":")
@@ -384,7 +579,6 @@ if __name__ == "__main__":
         sys.exit(1)
 
     # Read ROS packages from the file 'packages_ros{ros_version}.txt'
-    root_path = Path(__file__).expanduser().resolve().parent
     ros_packages_file = root_path.joinpath(f"packages_ros{ros_version}.txt")
     # Read extra ROS environment variables from the file 'env_vars_ros{ros_version}.txt'
     extra_ros_env_vars_file = root_path.joinpath(f"env_vars_ros{ros_version}.txt")
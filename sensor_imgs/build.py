@@ -6,6 +6,7 @@ import getpass
 import os
 from pathlib import Path
 import re
+import string
 import subprocess
 import sys
 from typing import Dict, Union
@@ -15,6 +16,26 @@ from jinja2 import Environment, FileSystemLoader
 
 if __name__ == "__main__":
 
+    # Characters allowed in the parts of a Docker image name [HOST[:PORT_NUMBER]/]PATH[:TAG]:
+    #   • HOST: lower‑case letters, digits, dots and dashes.
+    #   • PORT_NUMBER: digits.
+    #   • PATH: components of lower‑case letters and digits, separated by separators.
+    #   • TAG: letters, digits, underscores, dots and dashes.
+    _DIGITS = frozenset(string.digits)
+    _LOWER_ALNUMS = frozenset(string.ascii_lowercase + string.digits)
+    _HOST_CHARS = _LOWER_ALNUMS | frozenset(".-")
+    _TAG_CHARS = frozenset(string.ascii_letters + string.digits + "_.-")
+
+    # Lines of the build log written by the 'log' function of the build scripts,
+    # e.g. '[2025-01-31_12-00-00] message'. The build output is handled as raw bytes.
+    _SPECIFIC_LOG_RE = re.compile(rb"(\[\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}\])")
+
+    # Size of the write buffer of the log files.
+    _LOG_BUFFER_SIZE = 1 << 20
+
+    # Maximum size of the chunks of the build output read at once.
+    _OUTPUT_CHUNK_SIZE = 1 << 16
+
     def get_ros_distros_str(ros_distros: Dict[str, Dict[str, Union[str, int]]]) -> str:
         """
         Return a human-readable, column-aligned list of the available ROS variants.
@@ -55,13 +76,6 @@ if __name__ == "__main__":
         ]
         return "\n".join([header, *lines])
 
-    def img_exists_locally(img: str) -> bool:
-        cmd = ["docker", "image", "inspect", img]
-        # capture=True -> stdout y stderr redireted to PIPE (they are not shown in the terminal)
-        # check=False  -> it does not throw exception if the image does not exist
-        result = run_command(cmd, capture=True, check=False)
-        return result.returncode == 0
-
     def is_valid_docker_img_name(name: str) -> bool:
         """
         Validate a Docker image name according to Docker's official naming rules.
@@ -69,55 +83,89 @@ if __name__ == "__main__":
         Format:
             [HOST[:PORT_NUMBER]/]PATH[:TAG]
 
+        The name is validated with a single scan of every part, instead of with a backtracking regex.
+
         See: https://docs.docker.com/get-started/docker-concepts/building-images/build-tag-and-publish-an-image/#tagging-images
         """
 
-        # Optional registry prefix: host (lower‑case letters, digits, dots, dashes)
-        # with optional :PORT, followed by a slash.
-        host_and_port_prefix = r"([a-z0-9.-]+(:[0-9]+)?/)?"
+        # Optional TAG: the last colon starts the tag if there is no slash after it, since neither the
+        # PATH nor the tag can contain colons, and the PORT_NUMBER is always followed by a slash.
+        tag_start = name.rfind(":")
+
+        if tag_start > name.rfind("/"):
+            tag = name[tag_start + 1 :]
+
+            if not tag or any(c not in _TAG_CHARS for c in tag):
+                return False
+
+            name = name[:tag_start]
+
+        if is_valid_docker_img_path(name):
+            return True
+
+        # Optional registry prefix: HOST[:PORT_NUMBER], followed by a slash.
+        prefix_end = name.find("/")
 
-        # A separator inside a path component can be:
-        #   • a single dot
-        #   • one or two underscores
-        #   • one or more dashes
-        path_separator = r"(?:\.|_{1,2}|-+)"
+        if prefix_end == -1:
+            return False
 
-        # A path component must start and end with an alphanumeric character,
-        # separators are allowed only between alphanumerics.
-        path_component = rf"[a-z0-9]+(?:{path_separator}[a-z0-9]+)*"
+        host, port_sep, port = name[:prefix_end].partition(":")
 
-        # PATH = one or more components separated by '/'
-        path_re = rf"{path_component}(/{path_component})*"
+        if not host or any(c not in _HOST_CHARS for c in host):
+            return False
 
-        # Optional TAG: colon + allowed characters (letters, digits, '_', '.', '-')
-        tag_re = r"(:[a-zA-Z0-9_.-]+)?"
+        if port_sep and (not port or any(c not in _DIGITS for c in port)):
+            return False
 
-        # Full regex combining all parts
-        full_re = re.compile(rf"^{host_and_port_prefix}{path_re}{tag_re}$")
+        return is_valid_docker_img_path(name[prefix_end + 1 :])
 
-        return bool(full_re.match(name))
+    def is_valid_docker_img_path(path: str) -> bool:
+        # PATH = one or more components separated by '/'.
+        for component in path.split("/"):
+            # A path component must start and end with an alphanumeric character,
+            # separators are allowed only between alphanumerics.
+            if not component or component[0] not in _LOWER_ALNUMS or component[-1] not in _LOWER_ALNUMS:
+                return False
 
-    def run_command(
-        cmd: list[str], capture: bool = False, check: bool = True, cwd: Path | None = None
-    ) -> subprocess.CompletedProcess:
-        return subprocess.run(cmd, check=check, text=True, capture_output=capture, cwd=cwd)
+            i = 0
+
+            while i < len(component):
+                if component[i] in _LOWER_ALNUMS:
+                    i += 1
+                    continue
+
+                separator_start = i
+
+                while component[i] not in _LOWER_ALNUMS:
+                    i += 1
+
+                # A separator inside a path component can be:
+                #   • a single dot
+                #   • one or two underscores
+                #   • one or more dashes
+                separator = component[separator_start:i]
+
+                if separator not in (".", "_", "__") and separator.strip("-"):
+                    return False
+
+        return True
 
     # ----------------------------------------------------------------------------------------------
     # Main execution block
     # ----------------------------------------------------------------------------------------------
-    this_file = Path(__file__).resolve()
-    root_dir = this_file.parent
+    # Paths derived from root_dir and dockerfile are already resolved, so they're not resolved again.
+    root_dir = Path(__file__).resolve().parent
     ros_distros_yaml_file = root_dir.joinpath("ros_distros.yaml")
 
     if not ros_distros_yaml_file.is_file():
-        print(f"Error: File '{ros_distros_yaml_file.resolve()}' is required")
+        print(f"Error: File '{ros_distros_yaml_file}' is required")
         sys.exit(1)
 
     try:
         with open(ros_distros_yaml_file, "r") as f:
             ros_distros = yaml.safe_load(f)
     except (FileNotFoundError, yaml.YAMLError):
-        print(f"Error: Could not read or parse the file '{ros_distros_yaml_file.resolve()}'", file=sys.stderr)
+        print(f"Error: Could not read or parse the file '{ros_distros_yaml_file}'", file=sys.stderr)
         sys.exit(1)
 
     parser = argparse.ArgumentParser(
@@ -205,14 +253,17 @@ if __name__ == "__main__":
     ubuntu_version = ros_distros[ros_distro]["ubuntu_version"]
 
     if not dockerfile.is_file():
-        print(f"Error: Dockerfile '{dockerfile.resolve()}' does not exist or is not a file", file=sys.stderr)
+        print(f"Error: Dockerfile '{dockerfile}' does not exist or is not a file", file=sys.stderr)
         sys.exit(1)
 
     if not is_valid_docker_img_name(img_id_to_build):
         print(f"Error: Invalid Docker image name: '{img_id_to_build}'", file=sys.stderr)
         sys.exit(1)
 
-    creation_time = datetime.now(timezone.utc).strftime("%Y-%m-%d_%H-%M-%S")
+    # The creation time is taken only once, so the 'created' label and the name of the log files refer
+    # to exactly the same instant.
+    creation_time = datetime.now(timezone.utc)
+    creation_timestamp = creation_time.strftime("%Y-%m-%d_%H-%M-%S")
 
     # With DOCKER_BUILDKIT enabled, we can use advanced build features like volume mounts, like:
     # RUN --mount=type=bind,source=...,target=... && <command>
@@ -229,7 +280,7 @@ if __name__ == "__main__":
         "docker",
         "build",
         "--file",
-        str(dockerfile.resolve()),
+        str(dockerfile),
         "--progress=plain",
     ]
 
@@ -250,7 +301,7 @@ if __name__ == "__main__":
         cmd += ["--build-arg", f"{k}={v}"]
 
     labels = {
-        "org.opencontainers.image.created": datetime.now(timezone.utc).isoformat(),
+        "org.opencontainers.image.created": creation_time.isoformat(),
         "org.opencontainers.image.title": args.meta_title,
         "org.opencontainers.image.description": args.meta_desc,
         "org.opencontainers.image.authors": args.meta_authors,
@@ -265,8 +316,7 @@ if __name__ == "__main__":
 
     log_dir = Path("/tmp")
     img_id_sanitized = img_id_to_build.replace(":", "_").replace("/", "_")
-    timestamp_log = datetime.now(timezone.utc).strftime("%Y-%m-%d_%H-%M-%S")
-    log_prefix = f"build_img_{img_id_sanitized}_{timestamp_log}"
+    log_prefix = f"build_img_{img_id_sanitized}_{creation_timestamp}"
     complete_log_file = log_dir.joinpath(f"{log_prefix}_complete.log")
     specific_log_file = log_dir.joinpath(f"{log_prefix}_specific.log")
 
@@ -280,21 +330,49 @@ if __name__ == "__main__":
         print("Executing command:")
         print(" ".join(cmd))
 
-        with subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,  # Combine stdout and stderr
-            text=True,  # Decode directly to strings
-            bufsize=1,  # Enable line buffering for real-time output
-        ) as process, open(complete_log_file, "w") as full_log:
-
-            # Read each line of the subprocess's output as it is produced, i.e., in real-time.
-            for line in process.stdout:
-                print(line, end="", flush=True)
-                full_log.write(line)  # Full log
-
-            # Ensure the log file is flushed to disk.
+        # The output of the build is handled as raw bytes, read in large chunks, instead of decoding
+        # and printing it line by line.
+        sys.stdout.flush()
+
+        with (
+            subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,  # Combine stdout and stderr
+                bufsize=0,  # Unbuffered binary pipe, chunks are available as soon as they are produced
+            ) as process,
+            # The logs are written as bytes through a large buffer, so the many short lines of the build
+            # don't turn into many small writes to disk.
+            open(complete_log_file, "wb", buffering=_LOG_BUFFER_SIZE) as full_log,
+            open(specific_log_file, "wb", buffering=_LOG_BUFFER_SIZE) as specific_log,
+        ):
+            matches = 0
+            # Last line of the previous chunk, when the chunk doesn't end with a newline.
+            pending_line = b""
+
+            # Read the subprocess's output as it is produced, i.e., in real-time.
+            # Those lines that match the pattern '_SPECIFIC_LOG_RE' are also written to the specific log,
+            # so the complete log doesn't need to be read again once the build has finished.
+            while chunk := os.read(process.stdout.fileno(), _OUTPUT_CHUNK_SIZE):
+                sys.stdout.buffer.write(chunk)
+                sys.stdout.buffer.flush()
+                full_log.write(chunk)  # Full log
+
+                lines = (pending_line + chunk).split(b"\n")
+                pending_line = lines.pop()
+
+                for line in lines:
+                    if _SPECIFIC_LOG_RE.search(line):
+                        specific_log.write(line + b"\n")  # Specific log
+                        matches += 1
+
+            if pending_line and _SPECIFIC_LOG_RE.search(pending_line):
+                specific_log.write(pending_line)
+                matches += 1
+
+            # Ensure the log files are flushed to disk, the size of the complete log is checked below.
             full_log.flush()
+            specific_log.flush()
             # Wait for the process to finish and check the exit code
             process.wait()
             exit_code = process.returncode
@@ -302,33 +380,14 @@ if __name__ == "__main__":
             if exit_code == 0:
                 print(f"\nDocker build process ended with SUCCESS for the image '{img_id_to_build}'")
             else:
+                # stderr is redirected to stdout, so the error messages are already in the logs.
                 print(
-                    f"\nDocker build process ended with FAILURE (exit code {exit_code}) for the image '{img_id_to_build}': {process.stderr.strip()}"
+                    f"\nDocker build process ended with FAILURE (exit code {exit_code}) for the image '{img_id_to_build}'"
                 )
 
             if complete_log_file.exists():
                 if complete_log_file.stat().st_size > 0:
                     print(f"Log file '{complete_log_file}' is ready")
-
-                    # Extract, from the complete log, those lines that match the pattern 'specific_log_pattern'.
-                    specific_log_pattern = re.compile(r"(\[\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}\])")
-                    matches = 0
-
-                    with complete_log_file.open("r") as fin, specific_log_file.open("w") as fout:
-                        for line in fin:
-                            if specific_log_pattern.search(line):
-                                fout.write(line)
-                                matches += 1
-
-                    if matches == 0:
-                        print("No matching specific log lines found.")
-                        try:
-                            specific_log_file.unlink()
-                        except OSError as e:
-                            print(f"Error: Could not remove log file: {e}", file=sys.stderr)
-                            exit_code = exit_code if exit_code != 0 else 1
-                    else:
-                        print(f"Specific log file '{specific_log_file}' is ready.")
                 else:
                     try:
                         complete_log_file.unlink(missing_ok=True)
@@ -337,6 +396,16 @@ if __name__ == "__main__":
                         exit_code = exit_code if exit_code != 0 else 1
             else:
                 print(f"Log file '{complete_log_file}' does not exist.")
+
+            if matches == 0:
+                print("No matching specific log lines found.")
+                try:
+                    specific_log_file.unlink(missing_ok=True)
+                except OSError as e:
+                    print(f"Error: Could not remove log file: {e}", file=sys.stderr)
+                    exit_code = exit_code if exit_code != 0 else 1
+            else:
+                print(f"Specific log file '{specific_log_file}' is ready.")
     except KeyboardInterrupt:
         print("Aborted by user (Ctrl-C)")
     except Exception as e: